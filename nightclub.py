@@ -6,89 +6,158 @@ import argparse
 import requests
 import csv
 import re
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-CLUB_HINTS = [
-    r"\bclub\b", r"\bnightclub\b", r"\bdiscotheque\b",
-    r"\bwarehouse\b", r"\blounge\b", r"\bbasement\b",
-    r"\broom\b", r"\bterrace\b", r"\bbar\b"
-]
-CLUB_REGEX = re.compile("|".join(CLUB_HINTS), re.IGNORECASE)
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+CLUB_WORDS = frozenset({
+    "club", "nightclub", "discotheque",
+    "warehouse", "lounge", "basement",
+    "room", "terrace", "bar"
+})
+_SPLIT = re.compile(r"\W+")
+
+# Shared fallback for missing JSON objects; only ever read from
+_EMPTY = {}
+
+
+def make_session(cache_path: str | None = None) -> requests.Session:
+    """Pooled session with retries; optionally backed by a requests-cache sqlite file."""
+    if cache_path:
+        from requests_cache import CachedSession
+        session = CachedSession(
+            cache_path, backend="sqlite", expire_after=3600,
+            cache_control=True, stale_if_error=True,
+            # Keep the API key out of stored URLs and cache keys
+            ignored_parameters=["apikey"],
+        )
+    else:
+        session = requests.Session()
+    # Accept-Encoding is left to urllib3, which adds "br" when brotli is installed
+    session.headers["User-Agent"] = "nightclub/1.0"
+    session.mount("https://", HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.3,
+                          status_forcelist=[429, 500, 502, 503, 504]),
+    ))
+    return session
+
+
+# One pooled session so keep-alive connections are reused across pages and artists
+SESSION = make_session()
+
+
+def _parse_iso(s: str | None) -> datetime:
+    try:
+        return datetime.fromisoformat(s[:-1] if s and s.endswith("Z") else (s or ""))
+    except ValueError:
+        return datetime.max
 
 
 def looks_like_club(venue_name: str) -> bool:
-    return bool(CLUB_REGEX.search(venue_name or ""))
+    return not CLUB_WORDS.isdisjoint(_SPLIT.split((venue_name or "").lower()))
+
+
+class TooManyResults(Exception):
+    """A keyword-less sweep matched more events than max_pages can cover."""
 
 
 def tm_events_for_artist(
-    artist: str,
+    artist: str | None,
     apikey: str,
     country: str | None = None,
     city: str | None = None,
-    date_from: str | None = None,
-    date_to: str | None = None,
+    start_dt: str | None = None,
+    end_dt: str | None = None,
     max_pages: int = 4,
     size: int = 100,
+    complete_only: bool = False,
+    session: requests.Session | None = None,
 ):
-    """Generator yielding Ticketmaster events for a given artist."""
+    """Generator yielding Ticketmaster events for a given artist.
+
+    start_dt/end_dt are Ticketmaster datetime strings (YYYY-MM-DDTHH:MM:SSZ).
+    With artist=None every Electronic event in the window is returned; pass
+    complete_only=True to raise TooManyResults rather than truncate at max_pages.
+    Requests go through session, defaulting to the shared SESSION.
+    """
     base = "https://app.ticketmaster.com/discovery/v2/events.json"
     params = {
         "apikey": apikey,
-        "keyword": artist,
         "classificationName": "Electronic",
         "size": size,
         "sort": "date,asc",
     }
+    if artist:
+        params["keyword"] = artist
     if country:
         params["countryCode"] = country
     if city:
         params["city"] = city
-    if date_from:
-        params["startDateTime"] = f"{date_from}T00:00:00Z"
-    if date_to:
-        params["endDateTime"] = f"{date_to}T23:59:59Z"
+    if start_dt:
+        params["startDateTime"] = start_dt
+    if end_dt:
+        params["endDateTime"] = end_dt
+
+    session = session or SESSION
 
-    page = 0
-    while page < max_pages:
+    def get_page(page):
         params["page"] = page
-        r = requests.get(base, params=params, timeout=20)
+        r = session.get(base, params=params, timeout=20)
         r.raise_for_status()
-        data = r.json()
+        return json_loads(r.content)
 
-        events = (data.get("_embedded", {}) or {}).get("events", []) or []
+    if max_pages < 1:
+        return
+    data = get_page(0)
+    # A missing page object means unknown totals: use page 0 alone, as before
+    pg = data.get("page") or _EMPTY
+    if pg.get("totalElements") == 0:
+        return
+    if complete_only and pg.get("totalPages", 1) > max_pages:
+        raise TooManyResults(pg.get("totalElements"))
+    # Page 0 tells us how many pages exist; never request past that
+    total_pages = min(max_pages, pg.get("totalPages", 1))
+
+    for page in range(total_pages):
+        if page:
+            data = get_page(page)
+
+        events = (data.get("_embedded") or _EMPTY).get("events") or []
         for ev in events:
+            emb = ev.get("_embedded") or _EMPTY
+            start = (ev.get("dates") or _EMPTY).get("start") or _EMPTY
 
             vname, city_str = "", ""
-            venues = (ev.get("_embedded", {}) or {}).get("venues", []) or []
+            venues = emb.get("venues") or []
             if venues:
                 v = venues[0]
                 vname = v.get("name", "") or ""
-                city_str = ", ".join(filter(None, [
-                    (v.get("city") or {}).get("name", ""),
-                    (v.get("country") or {}).get("countryCode", "")
-                ]))
+                cn = (v.get("city") or _EMPTY).get("name") or ""
+                cc = (v.get("country") or _EMPTY).get("countryCode") or ""
+                city_str = f"{cn}, {cc}" if cn and cc else (cn or cc)
 
-            lineup = ", ".join([
-                a.get("name", "")
-                for a in (ev.get("_embedded", {}) or {}).get("attractions", []) or []
-            ])
+            names = [n for n in (a.get("name") for a in emb.get("attractions") or []) if n]
 
             yield {
                 "source": "Ticketmaster",
+                "id": ev.get("id"),
                 "artist": artist,
-                "date": (ev.get("dates", {}) or {}).get("start", {}).get("dateTime"),
+                "date": start.get("dateTime"),
                 "venue": vname,
                 "city": city_str,
-                "lineup": lineup,
+                "lineup": ", ".join(names),
+                "attractions": names,
                 "url": ev.get("url"),
             }
 
-        pg = (data.get("page") or {})
-        total_pages = pg.get("totalPages", 1)
-        page += 1
-        if page >= total_pages:
-            break
-
 
 def main():
     p = argparse.ArgumentParser(
@@ -113,55 +182,125 @@ def main():
         help="Disable nightclub heuristic filter (show all venues)"
     )
     p.add_argument("--max-pages", type=int, default=4,
-                   help="Max Ticketmaster pages per artist (default 4)")
+                   help="Max Ticketmaster pages per query (default 4)")
+    p.add_argument("--cache", default=None, metavar="PATH",
+                   help="Cache Ticketmaster responses in this sqlite file for an hour "
+                        "(requires requests-cache)")
     args = p.parse_args()
 
-    today = datetime.utcnow().date()
+    today = datetime.now(timezone.utc).date()
     date_from = args.date_from or today.isoformat()
     date_to = args.date_to or (today + timedelta(days=90)).isoformat()
+    start_dt = f"{date_from}T00:00:00Z"
+    end_dt = f"{date_to}T23:59:59Z"
 
     tm_key = os.environ.get("TICKETMASTER_API_KEY")
     if not tm_key:
         print("ERROR: set TICKETMASTER_API_KEY in your environment.", file=sys.stderr)
         sys.exit(1)
 
-    rows = []
-    for artist in args.artists:
+    session = SESSION
+    if args.cache:
+        try:
+            session = make_session(args.cache)
+        except ImportError:
+            print("ERROR: --cache requires requests-cache (pip install requests-cache).",
+                  file=sys.stderr)
+            sys.exit(1)
+
+    def fetch(artist, **kw):
+        # Keep the pages that arrived before a failure; TooManyResults propagates
+        evs = []
         try:
             for ev in tm_events_for_artist(
                 artist,
                 tm_key,
                 country=args.country,
                 city=args.city,
-                date_from=date_from,
-                date_to=date_to,
+                start_dt=start_dt,
+                end_dt=end_dt,
                 max_pages=args.max_pages,
+                session=session,
+                **kw,
             ):
-                if args.no_club_filter or looks_like_club(ev["venue"] or ""):
-                    rows.append(ev)
+                evs.append(ev)
+        except TooManyResults:
+            raise
         except Exception as e:
-            print(f"[Ticketmaster] {artist}: {e}", file=sys.stderr)
+            return evs, e
+        return evs, None
 
-    # Sort by ISO dates
-    def norm_dt(x):
+    rows = []
+    rows_by_id = {}
+
+    def keep(ev, artists):
+        # The same event can turn up under several artists; credit all of them
+        ev_id = ev.get("id")
+        row = rows_by_id.get(ev_id) if ev_id else None
+        if row is not None:
+            row["_artists"].extend(a for a in artists if a not in row["_artists"])
+            row["artist"] = ", ".join(row["_artists"])
+            return
+        if args.no_club_filter or looks_like_club(ev["venue"] or ""):
+            ev["_artists"] = list(artists)
+            ev["artist"] = ", ".join(artists)
+            ev["_dt"] = _parse_iso(ev["date"])
+            rows.append(ev)
+            if ev_id:
+                rows_by_id[ev_id] = ev
+
+    # For longer artist lists, sweep the whole Electronic window once and match
+    # attraction names locally instead of one keyword search per artist. This
+    # only matches exact attraction names (keyword search is fuzzier), and falls
+    # back to per-artist queries if the sweep fails or would not fit in max_pages.
+    sweep = None
+    if len(args.artists) > 3:
         try:
-            return datetime.fromisoformat((x.get("date") or "").replace("Z", ""))
-        except Exception:
-            return datetime.max
+            evs, err = fetch(None, complete_only=True)
+        except TooManyResults:
+            pass
+        else:
+            # A partial sweep would silently miss artists, so discard it
+            if err:
+                print(f"[Ticketmaster] sweep: {err}", file=sys.stderr)
+            else:
+                sweep = evs
+
+    if sweep is not None:
+        by_name = {a.lower(): a for a in args.artists}
+        for ev in sweep:
+            names = {n.lower() for n in ev["attractions"]}
+            matched = [a for key, a in by_name.items() if key in names]
+            if matched:
+                keep(ev, matched)
+    else:
+        # Artists are independent and I/O-bound, so fetch them concurrently
+        with ThreadPoolExecutor(max_workers=min(8, len(args.artists))) as ex:
+            futures = {ex.submit(fetch, artist): artist for artist in args.artists}
+            # Collect in submission order so output doesn't depend on timing
+            for fut, artist in futures.items():
+                evs, err = fut.result()
+                if err:
+                    print(f"[Ticketmaster] {artist}: {err}", file=sys.stderr)
+                for ev in evs:
+                    keep(ev, [artist])
 
-    rows.sort(key=norm_dt)
+    # Sort by ISO dates
+    rows.sort(key=lambda r: r["_dt"])
 
     with open(args.csv, "w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(
-            f, fieldnames=["date", "artist", "venue", "city", "lineup", "url", "source"]
+        w = csv.writer(f)
+        w.writerow(["date", "artist", "venue", "city", "lineup", "url", "source"])
+        w.writerows(
+            (r["date"], r["artist"], r["venue"], r["city"], r["lineup"], r["url"], r["source"])
+            for r in rows
         )
-        w.writeheader()
-        for r in rows:
-            w.writerow(r)
 
     print(f"Wrote {len(rows)} events to {args.csv}")
-    for r in rows:
-        print(f"{r['date'] or 'TBA'} | {r['artist']} @ {r['venue']} — {r['city']} | {r['url']}")
+    sys.stdout.write("".join(
+        f"{r['date'] or 'TBA'} | {r['artist']} @ {r['venue']} — {r['city']} | {r['url']}\n"
+        for r in rows
+    ))
 
 
 if __name__ == "__main__":